@@ -0,0 +1,105 @@
+"""
+canvas_gen.py — Canvas element generation (Phase 2 of /chat).
+
+Concurrent drawing requests for the same message on the same canvas are
+coalesced onto a single in-flight canvas_chain call, so a burst of retries
+or duplicate submissions costs one LLM round-trip instead of N. The shared
+call is cancelled once its last waiter goes away, so a discarded request
+doesn't keep paying for the round-trip. Completed
+results are kept in a small TTL + LRU cache under the same key; because the
+key includes the canvas context, a /chat/context update naturally misses.
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+
+from parsers import parse_canvas_json
+from prompts import canvas_chain
+
+CANVAS_TIMEOUT = 60  # seconds
+CANVAS_CACHE_SIZE = 512
+CANVAS_CACHE_TTL = 600  # seconds — canvas_llm runs at temperature 0.2
+
+_inflight: dict[bytes, asyncio.Task[list[dict] | None]] = {}
+_waiters: dict[bytes, int] = {}
+_cache: OrderedDict[bytes, tuple[float, list[dict]]] = OrderedDict()
+
+
+def _request_key(message: str, canvas_context: str) -> bytes:
+    """Compact digest of a drawing request (message + canvas state)."""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(message.strip().lower().encode("utf-8"))
+    h.update(b"\x00")
+    h.update(canvas_context.encode("utf-8"))
+    return h.digest()
+
+
+def _cache_get(key: bytes) -> list[dict] | None:
+    """Return a fresh cached result (refreshing its LRU position) or None."""
+    entry = _cache.get(key)
+    if entry is None:
+        return None
+    stored_at, elements = entry
+    if time.monotonic() - stored_at > CANVAS_CACHE_TTL:
+        del _cache[key]
+        return None
+    _cache.move_to_end(key)
+    return elements
+
+
+def _cache_put(key: bytes, elements: list[dict]) -> None:
+    """Store a result, evicting the least recently used entry when full."""
+    _cache[key] = (time.monotonic(), elements)
+    _cache.move_to_end(key)
+    if len(_cache) > CANVAS_CACHE_SIZE:
+        _cache.popitem(last=False)
+
+
+async def _run_canvas_chain(key: bytes, message: str, canvas_context: str) -> list[dict] | None:
+    """Call canvas_chain once, parse its output, and cache non-empty results."""
+    async with asyncio.timeout(CANVAS_TIMEOUT):
+        raw_output = await canvas_chain.ainvoke({
+            "canvas_context": canvas_context,
+            "input": message,
+        })
+    elements = parse_canvas_json(raw_output)
+    if elements:
+        _cache_put(key, elements)
+    return elements
+
+
+async def generate_canvas_elements(message: str, canvas_context: str) -> list[dict] | None:
+    """Generate canvas elements for a drawing request.
+
+    Serves a cached result when available, otherwise joins an identical
+    in-flight request. Waiters are shielded so one client disconnecting
+    doesn't cancel the shared call; when the last waiter is cancelled the
+    call itself is cancelled too.
+    """
+    key = _request_key(message, canvas_context)
+    cached = _cache_get(key)
+    if cached is not None:
+        return cached
+
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.create_task(_run_canvas_chain(key, message, canvas_context))
+        _inflight[key] = task
+        task.add_done_callback(lambda t: _inflight.pop(key) if _inflight.get(key) is t else None)
+
+    _waiters[key] = _waiters.get(key, 0) + 1
+    try:
+        return await asyncio.shield(task)
+    finally:
+        remaining = _waiters.pop(key) - 1
+        if remaining:
+            _waiters[key] = remaining
+        elif not task.done():
+            # Nobody wants the result any more; unlist it so a new request
+            # starts a fresh call instead of joining the cancelled one
+            task.cancel()
+            if _inflight.get(key) is task:
+                del _inflight[key]
@@ -7,6 +7,8 @@ rather than reading os.getenv() ad-hoc.
 from __future__ import annotations
 
 import os
+
+import httpx
 from dotenv import load_dotenv
 from langchain_openai import ChatOpenAI
 
@@ -22,11 +24,40 @@ CHAT_MODEL_VISION: str = os.getenv("CHAT_MODEL_VISION", "meta-llama/llama-4-scou
 CHAT_MODEL_VISION_FALLBACK: str = os.getenv("CHAT_MODEL_VISION_FALLBACK", "openai/gpt-4o-mini")
 CHAT_PORT: int = int(os.getenv("CHAT_PORT", "3003"))
 MAX_HISTORY_MESSAGES: int = int(os.getenv("MAX_HISTORY_MESSAGES", "20"))
+PAGED_AFTER_MESSAGES: int = int(os.getenv("PAGED_AFTER_MESSAGES", "8"))
+MAX_PROMPT_TOKENS: int = int(os.getenv("MAX_PROMPT_TOKENS", "8000"))
 SESSION_TTL_HOURS: int = int(os.getenv("SESSION_TTL_HOURS", "24"))
+MAX_SESSIONS: int = int(os.getenv("MAX_SESSIONS", "10000"))
+OFFLOAD_THREADS: int = int(os.getenv("OFFLOAD_THREADS", "8"))
+
+GROQ_BASE_URL = "https://api.groq.com/openai/v1"
+OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
 
 if not GROQ_API_KEY and not OPENROUTER_API_KEY:
     raise ValueError("Either GROQ_API_KEY or OPENROUTER_API_KEY is required. Set in .env")
 
+# ─── Shared HTTP Client ───────────────────────────────────────────────────────
+#
+# Every async LLM call goes through one connection pool, so chat, canvas and
+# vision requests to the same provider reuse warm keep-alive connections
+# instead of each model paying its own TCP/TLS handshakes. HTTP/2 lets the
+# concurrent chat stream and canvas call share a single connection. Idle
+# connections are kept for a minute (httpx defaults to 5s), so the boot
+# warmup and the gaps between a user's messages don't re-handshake.
+# Closed in main.py's lifespan shutdown.
+
+LLM_KEEPALIVE_EXPIRY = 60.0  # seconds
+
+llm_http_client = httpx.AsyncClient(
+    http2=True,
+    limits=httpx.Limits(
+        max_connections=100,
+        max_keepalive_connections=50,
+        keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+    ),
+    timeout=httpx.Timeout(90.0, connect=10.0),
+)
+
 # ─── LLMs: Groq (primary) + OpenRouter (fallback) ────────────────────────────
 #
 # Primary: Groq with llama-3.3-70b-versatile (fast, free)
@@ -37,39 +68,43 @@ if not GROQ_API_KEY and not OPENROUTER_API_KEY:
 chat_llm = ChatOpenAI(
     model=CHAT_MODEL_PRIMARY,
     api_key=GROQ_API_KEY or "unused",
-    base_url="https://api.groq.com/openai/v1",
+    base_url=GROQ_BASE_URL,
     temperature=0.8,
     max_tokens=4096,
     streaming=True,
+    http_async_client=llm_http_client,
 ) if GROQ_API_KEY else None
 
 canvas_llm = ChatOpenAI(
     model=CHAT_MODEL_PRIMARY,
     api_key=GROQ_API_KEY or "unused",
-    base_url="https://api.groq.com/openai/v1",
+    base_url=GROQ_BASE_URL,
     temperature=0.2,
     max_tokens=4096,
     streaming=False,
+    http_async_client=llm_http_client,
 ) if GROQ_API_KEY else None
 
 # Fallback LLM — OpenRouter
 fallback_chat_llm = ChatOpenAI(
     model=CHAT_MODEL_FALLBACK,
     api_key=OPENROUTER_API_KEY or "unused",
-    base_url="https://openrouter.ai/api/v1",
+    base_url=OPENROUTER_BASE_URL,
     temperature=0.8,
     max_tokens=4096,
     streaming=True,
+    http_async_client=llm_http_client,
     extra_body={"reasoning": {"enabled": True}},
 ) if OPENROUTER_API_KEY else None
 
 fallback_canvas_llm = ChatOpenAI(
     model=CHAT_MODEL_FALLBACK,
     api_key=OPENROUTER_API_KEY or "unused",
-    base_url="https://openrouter.ai/api/v1",
+    base_url=OPENROUTER_BASE_URL,
     temperature=0.2,
     max_tokens=4096,
     streaming=False,
+    http_async_client=llm_http_client,
     extra_body={"reasoning": {"enabled": True}},
 ) if OPENROUTER_API_KEY else None
 
@@ -77,19 +112,21 @@ fallback_canvas_llm = ChatOpenAI(
 vision_llm = ChatOpenAI(
     model=CHAT_MODEL_VISION,
     api_key=GROQ_API_KEY or "unused",
-    base_url="https://api.groq.com/openai/v1",
+    base_url=GROQ_BASE_URL,
     temperature=0.4,
     max_tokens=2048,
     streaming=True,
+    http_async_client=llm_http_client,
 ) if GROQ_API_KEY else None
 
 fallback_vision_llm = ChatOpenAI(
     model=CHAT_MODEL_VISION_FALLBACK,
     api_key=OPENROUTER_API_KEY or "unused",
-    base_url="https://openrouter.ai/api/v1",
+    base_url=OPENROUTER_BASE_URL,
     temperature=0.4,
     max_tokens=2048,
     streaming=True,
+    http_async_client=llm_http_client,
 ) if OPENROUTER_API_KEY else None
 
 # Use primary if available, otherwise fallback
@@ -7,7 +7,8 @@ Modular structure:
     config.py     — Environment variables and LLM initialization
     models.py     — Pydantic request/response schemas
     parsers.py    — Text processing (think-tags, markdown, JSON)
-    prompts.py    — LangChain prompt templates and LCEL chains
+    prompts.py    — Prompt templates, chat messages and the canvas chain
+    canvas_gen.py — Canvas element generation (coalesced canvas_chain calls)
     sessions.py   — In-memory session management
     tools.py      — AI tool intent detection and routing
     routes/       — FastAPI endpoint modules:
@@ -27,13 +28,43 @@ Endpoints:
 
 from __future__ import annotations
 
-from contextlib import asynccontextmanager
+import asyncio
+import logging
+import os
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, suppress
+from logging.handlers import QueueHandler, QueueListener
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
+
+from config import (
+    CHAT_MODEL_PRIMARY, CHAT_MODEL_FALLBACK, CHAT_PORT, GROQ_API_KEY, OPENROUTER_API_KEY,
+    GROQ_BASE_URL, OPENROUTER_BASE_URL, OFFLOAD_THREADS, SESSION_TTL_HOURS, llm_http_client,
+)
+from parsers import md_to_html
+from sessions import cleanup_stale_sessions
+
+# ─── Logging ──────────────────────────────────────────────────────────────────
+#
+# Request handlers only enqueue log records; a listener thread does the
+# actual (blocking) stdout writes, so error bursts during LLM outages don't
+# serialize the event loop on the stdout lock. HTTP client libraries log a
+# line per request at INFO, so they are held to WARNING.
+
+_log_queue: queue.SimpleQueue[logging.LogRecord] = queue.SimpleQueue()
+_log_listener = QueueListener(_log_queue, logging.StreamHandler())
+_log_handler = QueueHandler(_log_queue)
+_log_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(name)s] %(message)s"))
+logging.basicConfig(level=logging.INFO, handlers=[_log_handler])
+for _noisy in ("httpx", "httpcore", "openai"):
+    logging.getLogger(_noisy).setLevel(logging.WARNING)
+_log_listener.start()
+
+logger = logging.getLogger(__name__)
 
-import os
-from config import CHAT_MODEL_PRIMARY, CHAT_MODEL_FALLBACK, CHAT_PORT, GROQ_API_KEY, OPENROUTER_API_KEY
 
 # ─── LangChain OpenAI Monkey Patch for OpenRouter Reasoning ───────────────────
 #
@@ -57,6 +88,45 @@ except Exception as e:
     print(f"[Warning] Could not patch langchain_openai message converter: {e}")
 
 
+# ─── Warmup ───────────────────────────────────────────────────────────────────
+
+async def _warmup() -> None:
+    """Take first-request costs at boot instead of on the first user.
+
+    Spins up the offload thread pool with a markdown render and opens
+    keep-alive connections to the configured providers, so the first chat
+    skips the TCP/TLS handshake. Failures are non-fatal.
+    """
+    await asyncio.to_thread(md_to_html, "**warmup**")
+
+    base_urls = [url for url, key in ((GROQ_BASE_URL, GROQ_API_KEY),
+                                      (OPENROUTER_BASE_URL, OPENROUTER_API_KEY)) if key]
+    results = await asyncio.gather(
+        *(llm_http_client.head(url, timeout=5.0) for url in base_urls),
+        return_exceptions=True,
+    )
+    for url, result in zip(base_urls, results):
+        if isinstance(result, Exception):
+            logger.warning("Warmup connection to %s failed: %s", url, result)
+
+
+# ─── Session Cleanup ──────────────────────────────────────────────────────────
+
+# Sweep idle sessions ten times per TTL, so one lives at most ~1.1x TTL
+CLEANUP_INTERVAL = SESSION_TTL_HOURS * 3600 / 10  # seconds
+
+
+async def _cleanup_loop() -> None:
+    """Periodically drop idle sessions, even when no new sessions arrive."""
+    while True:
+        await asyncio.sleep(CLEANUP_INTERVAL)
+        try:
+            cleanup_stale_sessions()
+        except Exception:
+            # Keep the loop alive; the next sweep retries
+            logger.exception("Session cleanup sweep failed")
+
+
 # ─── FastAPI App ──────────────────────────────────────────────────────────────
 
 @asynccontextmanager
@@ -67,14 +137,27 @@ async def lifespan(app: FastAPI):
     print(f"[Boot] Fallback: OpenRouter ({CHAT_MODEL_FALLBACK})")
     print(f"[Boot] Groq key: {'set' if GROQ_API_KEY else 'MISSING'}")
     print(f"[Boot] OpenRouter key: {'set' if OPENROUTER_API_KEY else 'MISSING'}")
+    # Sized for md_to_html and other to_thread offloads under concurrent chats
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=OFFLOAD_THREADS, thread_name_prefix="offload")
+    )
+    await _warmup()
+    cleanup_task = asyncio.create_task(_cleanup_loop())
     yield
+    cleanup_task.cancel()
+    with suppress(asyncio.CancelledError):
+        await cleanup_task
+    await llm_http_client.aclose()
     print("[Shutdown] Canvas AI Chat Service stopped")
+    _log_listener.stop()
 
 
 app = FastAPI(
     title="Canvas AI Chat Service",
     version="5.1.0",
     lifespan=lifespan,
+    # JSON endpoints serialize through orjson instead of stdlib json
+    default_response_class=ORJSONResponse,
 )
 
 # ─── CORS: restrict in production, allow all in dev ─────────────────────────
@@ -118,4 +201,6 @@ if __name__ == "__main__":
         host="0.0.0.0",
         port=CHAT_PORT,
         reload=True,
+        # loop/http stay "auto": uvloop and httptools are used when installed
+        # (pinned in the Dockerfile CMD), asyncio/h11 elsewhere, e.g. Windows
     )
@@ -3,38 +3,182 @@ parsers.py — Text processing utilities (think-tag stripping, markdown, JSON).
 """
 from __future__ import annotations
 
-import json
-import re
-from functools import lru_cache
+import hashlib
+import logging
+import string
+import threading
+from collections import OrderedDict
 
-import markdown as md
+import cmarkgfm
+import orjson
+from cmarkgfm.cmark import Options as CmarkOptions
+from pydantic import TypeAdapter, ValidationError
 
 from models import CanvasElement
 
-# ─── Compiled Regexes ─────────────────────────────────────────────────────────
+logger = logging.getLogger(__name__)
 
-_THINK_PATTERN = re.compile(r"<think>[\s\S]*?</think>", re.IGNORECASE)
-_FENCE_OPEN = re.compile(r"^```(?:json)?\s*\n?", re.MULTILINE)
-_FENCE_CLOSE = re.compile(r"\n?```\s*$", re.MULTILINE)
+# Validates a whole element list in one pydantic-core call
+_CANVAS_LIST_ADAPTER: TypeAdapter[list[CanvasElement]] = TypeAdapter(list[CanvasElement])
 
-_MD_EXTENSIONS: tuple[str, ...] = (
-    "fenced_code", "tables", "nl2br", "sane_lists", "smarty"
-)
+# ─── Markdown ─────────────────────────────────────────────────────────────────
+
+# cmark-gfm (native) covers fenced code, tables and autolinks; HARDBREAKS and
+# SMART replace python-markdown's nl2br and smarty extensions.
+_CMARK_OPTIONS: int = CmarkOptions.CMARK_OPT_HARDBREAKS | CmarkOptions.CMARK_OPT_SMART
+
+# Characters that can start markdown/GFM syntax, or that HTML escaping,
+# SMART punctuation, hard breaks, line-ending handling (\r), NUL replacement
+# or email autolinks would rewrite. Text without any of them renders as one
+# verbatim paragraph.
+_MD_SPECIAL = frozenset("#*_`~>[]-+|\\<&'\":=@\n\r\t\0")
+
+# Rendered HTML keyed by an 8-byte digest of the markdown, so the cache
+# doesn't also pin every (possibly long) source response in memory.
+# Insertion-ordered; the oldest entry is dropped when full. md_to_html runs
+# in to_thread workers, so inserts and evictions happen under a lock.
+MD_CACHE_SIZE = 256
+_md_cache: OrderedDict[bytes, str] = OrderedDict()
+_md_cache_lock = threading.Lock()
+
+
+_THINK_OPEN = "<think>"
+_THINK_CLOSE = "</think>"
+
+# ASCII-only lowering keeps indices aligned with the original text (unlike
+# str.lower(), which can change the length of some non-ASCII strings)
+_ASCII_LOWER = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
 
 
 def strip_think_tags(text: str) -> str:
-    """Remove <think>...</think> reasoning blocks from model output."""
-    return _THINK_PATTERN.sub("", text).lstrip("\n")
+    """Remove <think>...</think> reasoning blocks from model output.
+
+    A str.find scan over an ASCII-lowered copy, so tags match in any case.
+    An unclosed <think> is left in place, as with the original regex.
+    """
+    if "<" not in text:
+        return text.lstrip("\n")
+    lowered = text.translate(_ASCII_LOWER)
+    out: list[str] = []
+    pos = 0
+    while True:
+        start = lowered.find(_THINK_OPEN, pos)
+        if start == -1:
+            break
+        end = lowered.find(_THINK_CLOSE, start + len(_THINK_OPEN))
+        if end == -1:
+            break
+        out.append(text[pos:start])
+        pos = end + len(_THINK_CLOSE)
+    out.append(text[pos:] if pos else text)
+    return "".join(out).lstrip("\n")
+
+
+def _partial_tag_len(text: str, tag: str) -> int:
+    """Length of the trailing slice of `text` that could still open `tag`."""
+    start = text.rfind("<", max(0, len(text) - len(tag) + 1))
+    if start != -1 and tag.startswith(text[start:]):
+        return len(text) - start
+    return 0
+
+
+class ThinkStreamFilter:
+    """Incrementally drop <think>...</think> blocks from a token stream.
+
+    Visible text is returned as soon as it is known to be outside a think
+    block, so callers can forward it and accumulate the clean response
+    without a final regex pass. A short tail that might be the start of a
+    tag split across chunks (e.g. "<thi" + "nk>") is held back until the
+    next chunk resolves it. Tags match in any case, and a block that is
+    still open when the stream ends is returned by flush() unchanged, the
+    same as strip_think_tags.
+    """
+    __slots__ = ("inside", "_pending", "_block")
+
+    def __init__(self) -> None:
+        self.inside = False
+        self._pending = ""
+        self._block: list[str] = []  # raw text of the open block, tag included
+
+    def feed(self, token: str) -> str:
+        """Consume one streamed chunk and return its visible text (may be "")."""
+        buf = self._pending + token if self._pending else token
+        lowered = buf.translate(_ASCII_LOWER)
+        out: list[str] = []
+        pos = 0
+        while True:
+            tag = _THINK_CLOSE if self.inside else _THINK_OPEN
+            idx = lowered.find(tag, pos)
+            if idx == -1:
+                break
+            if self.inside:
+                self._block.clear()
+            else:
+                out.append(buf[pos:idx])
+                self._block.append(buf[idx:idx + len(tag)])
+            self.inside = not self.inside
+            pos = idx + len(tag)
+
+        keep = _partial_tag_len(lowered[pos:] if pos else lowered, tag)
+        end = len(buf) - keep
+        self._pending = buf[end:]
+        (self._block if self.inside else out).append(buf[pos:end])
+        return "".join(out)
+
+    def flush(self) -> str:
+        """Return any held-back text once the stream has ended."""
+        pending, self._pending = self._pending, ""
+        if self.inside:
+            self.inside = False
+            pending = "".join(self._block) + pending
+            self._block.clear()
+        return pending
 
 
-@lru_cache(maxsize=256)
 def md_to_html(text: str) -> str:
     """Convert LLM markdown to clean HTML for the frontend.
 
-    Cached with LRU (256 entries) — identical markdown fragments are common
-    during session replays and avoid repeated parsing overhead.
+    Cached (256 entries, digest-keyed) — identical markdown fragments are
+    common during session replays and avoid repeated parsing overhead.
+    """
+    if _is_plain_text(text):
+        return f"<p>{text}</p>\n" if text else ""
+
+    key = hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest()
+    html = _md_cache.get(key)
+    if html is None:
+        html = cmarkgfm.github_flavored_markdown_to_html(text, options=_CMARK_OPTIONS)
+        with _md_cache_lock:
+            _md_cache[key] = html
+            if len(_md_cache) > MD_CACHE_SIZE:
+                _md_cache.popitem(last=False)
+    return html
+
+
+def _is_plain_text(text: str) -> bool:
+    """True when `text` contains no markdown, so the parser can be skipped.
+
+    Short conversational replies ("Sure, done!") are the common case.
+    Ordered-list starts ("1. "), indentation, "..." (SMART ellipsis) and
+    "www." (autolink) also go to the parser.
     """
-    return md.markdown(text, extensions=list(_MD_EXTENSIONS))
+    return (
+        _MD_SPECIAL.isdisjoint(text)
+        and text == text.strip()
+        and not text[:1].isdigit()
+        and "..." not in text
+        and "www." not in text
+    )
+
+
+def _strip_fences(text: str) -> str:
+    """Drop a leading ```lang fence line and a trailing ``` fence (literal scans)."""
+    if text.startswith("```"):
+        nl = text.find("\n")
+        text = text[nl + 1:] if nl != -1 else text[3:].removeprefix("json")
+    if text.endswith("```"):
+        text = text[:-3].rstrip()
+    return text
 
 
 def parse_canvas_json(raw: str) -> list[dict] | None:
@@ -43,16 +187,19 @@ def parse_canvas_json(raw: str) -> list[dict] | None:
     Handles markdown fences, validates with Pydantic, and gracefully
     degrades when output doesn't perfectly match the schema.
     """
-    text = strip_think_tags(raw).strip()
-
     # Remove markdown fences if model wraps output
-    if text.startswith("```"):
-        text = _FENCE_OPEN.sub("", text)
-        text = _FENCE_CLOSE.sub("", text)
+    text = _strip_fences(strip_think_tags(raw).strip())
 
     try:
-        parsed = json.loads(text)
+        parsed = orjson.loads(text)
         if isinstance(parsed, list) and len(parsed) > 0:
+            try:
+                return _CANVAS_LIST_ADAPTER.dump_python(
+                    _CANVAS_LIST_ADAPTER.validate_python(parsed), exclude_none=True
+                )
+            except ValidationError:
+                pass  # some items don't fit; validate them one by one below
+
             validated: list[dict] = []
             for item in parsed:
                 try:
@@ -62,7 +209,7 @@ def parse_canvas_json(raw: str) -> list[dict] | None:
                     # Keep raw if close enough — LLM output may vary slightly
                     validated.append(item)
             return validated
-    except json.JSONDecodeError as e:
-        print(f"[Canvas] JSON parse error: {e}")
+    except orjson.JSONDecodeError as e:
+        logger.warning("Canvas JSON parse error: %s", e)
 
     return None
@@ -1,14 +1,13 @@
 """
-prompts.py — LangChain prompt templates and LCEL chain definitions.
+prompts.py — LangChain prompt templates, chat message building and the canvas chain.
 """
 from __future__ import annotations
 
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_core.output_parsers import StrOutputParser
-from langchain_core.messages import HumanMessage
-from langchain_core.runnables import RunnableLambda
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
 
-from config import chat_llm, canvas_llm, vision_llm
+from config import canvas_llm
 
 # ─── Prompts ──────────────────────────────────────────────────────────────────
 
@@ -54,48 +53,46 @@ Canvas context: {canvas_context}"""),
     ("human", "{input}"),
 ])
 
-# ─── LCEL Chains ─────────────────────────────────────────────────────────────
-
-# Chat chain: prompt → LLM (streams) — no parser so we can stream raw chunks
-chat_chain = chat_prompt | chat_llm
-
-# Vision chain: builds a proper multimodal message list so the vision LLM
-# receives the image as an image_url block (not a stringified list).
-# The `input` from sessions.py is already a list like:
+# ─── Chat Messages ────────────────────────────────────────────────────────────
+#
+# /chat streams straight from chat_llm / vision_llm with a prebuilt message
+# list instead of a prompt | llm chain, so each request skips template
+# formatting and Runnable dispatch. The multimodal `input` from sessions.py
+# is already a list like:
 #   [{"type": "text", "text": "..."}, {"type": "image_url", "image_url": {"url": "data:..."}}]
+# and is passed to the model as-is (not a stringified list).
 
-_VISION_SYSTEM_MSG = chat_prompt.messages[0]  # reuse the same system prompt
-
-def _build_vision_messages(chain_input: dict):
-    """Convert chain_input into a proper multimodal message list for the vision LLM."""
-    from langchain_core.messages import SystemMessage
-
-    # Render the system prompt template into a concrete SystemMessage
+def _render_chat_system_message() -> SystemMessage:
+    """Render the chat system prompt into a concrete SystemMessage."""
+    template = chat_prompt.messages[0]
     try:
-        rendered = _VISION_SYSTEM_MSG.format()
-        system_text = rendered.content
+        system_text = template.format().content
     except Exception:
         # Fallback: extract the template string directly
-        system_text = _VISION_SYSTEM_MSG.prompt.template if hasattr(_VISION_SYSTEM_MSG, 'prompt') else str(_VISION_SYSTEM_MSG)
+        system_text = template.prompt.template if hasattr(template, 'prompt') else str(template)
+    return SystemMessage(content=system_text)
+
 
-    messages = [SystemMessage(content=system_text)]
+# The system prompt has no variables, so render it once instead of per request
+_CHAT_SYSTEM_MSG = _render_chat_system_message()
+
+def build_chat_messages(chain_input: dict) -> list[BaseMessage]:
+    """Convert chain_input into the message list for chat_llm / vision_llm."""
+    messages: list[BaseMessage] = [_CHAT_SYSTEM_MSG]
 
     # Add conversation history
-    history = chain_input.get("history", [])
-    messages.extend(history)
+    messages.extend(chain_input.get("history", []))
 
-    # Add the current user message as a proper multimodal HumanMessage
+    # Add the current user message (multimodal list or plain text)
     user_input = chain_input["input"]
     if isinstance(user_input, list):
-        # Already multimodal: [{"type": "text", ...}, {"type": "image_url", ...}]
         messages.append(HumanMessage(content=user_input))
     else:
-        # Fallback: plain text
         messages.append(HumanMessage(content=str(user_input)))
 
     return messages
 
-vision_chain = RunnableLambda(_build_vision_messages) | vision_llm
+# ─── LCEL Chains ─────────────────────────────────────────────────────────────
 
 # Canvas chain: prompt → LLM (deterministic) → string parser
 canvas_chain = canvas_prompt | canvas_llm | StrOutputParser()
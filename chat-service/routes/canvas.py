@@ -3,6 +3,8 @@ routes/canvas.py — Canvas context, session clear, and session delete endpoints
 """
 from __future__ import annotations
 
+from collections import Counter
+
 from fastapi import APIRouter
 
 from models import CanvasContextRequest, ClearRequest
@@ -10,6 +12,10 @@ from sessions import get_or_create_session, get_session, delete_session as _dele
 
 router = APIRouter()
 
+# Element lines beyond this many chars (~512 prompt tokens) switch to the
+# compact one-line-per-element form; the context rides along on every turn.
+CONTEXT_CHAR_BUDGET = 2048
+
 
 @router.post("/chat/context")
 async def update_canvas_context(req: CanvasContextRequest):
@@ -23,18 +29,13 @@ async def update_canvas_context(req: CanvasContextRequest):
     """
     session = get_or_create_session(req.session_id)
 
+    # Cap at 50 to bound CPU time; items are unvalidated JSON, so skip non-objects
+    elements = [el for el in (req.elements or [])[:50] if isinstance(el, dict)]
+
     if req.description:
         session.canvas_context = req.description
-    elif req.elements:
-        elements = req.elements[:50]  # Cap at 50 to bound CPU time
-
-        # Build type counts
-        type_counts: dict[str, int] = {}
-        for el in elements:
-            el_type = el.get("type", "unknown")
-            type_counts[el_type] = type_counts.get(el_type, 0) + 1
-
-        counts_str = ", ".join(f"{count} {t}(s)" for t, count in type_counts.items())
+    elif elements:
+        type_counts = Counter(el.get("type", "unknown") for el in elements)
 
         # Find canvas bounds for spatial grouping
         all_y = [el.get("y", 0) for el in elements]
@@ -44,6 +45,7 @@ async def update_canvas_context(req: CanvasContextRequest):
 
         # Build detailed element descriptions
         element_parts: list[str] = []
+        compact_parts: list[str] = []
         selected_parts: list[str] = []
         image_parts: list[str] = []
 
@@ -82,6 +84,9 @@ async def update_canvas_context(req: CanvasContextRequest):
                 desc += " ★SELECTED"
 
             element_parts.append(desc)
+            compact_parts.append(
+                f'  [{i+1}] {el_type}' + (f' "{text[:30]}"' if text else "") + f" {position.split()[0]}"
+            )
 
             # Track selected elements
             if is_selected:
@@ -100,6 +105,15 @@ async def update_canvas_context(req: CanvasContextRequest):
                     img_desc += " ★SELECTED"
                 image_parts.append(img_desc)
 
+        if sum(map(len, element_parts)) > CONTEXT_CHAR_BUDGET:
+            # Busy board: drop coordinates/colors and keep the top types only
+            element_parts = compact_parts
+            counts_str = ", ".join(f"{count} {t}(s)" for t, count in type_counts.most_common(5))
+            if len(type_counts) > 5:
+                counts_str += " and more"
+        else:
+            counts_str = ", ".join(f"{count} {t}(s)" for t, count in type_counts.items())
+
         # Compose the full context
         ctx_lines = [
             f"The whiteboard has {len(req.elements)} element(s): {counts_str}.",
@@ -134,7 +148,7 @@ async def clear_session(req: ClearRequest):
     """Clear conversation history and canvas context for a session."""
     session = get_session(req.session_id)
     if session:
-        session.messages = []
+        session.clear_history()
         session.canvas_context = "The whiteboard is currently completely empty."
         return {"status": "ok", "message": "Session cleared"}
     return {"status": "ok", "message": "Session not found (already clean)"}
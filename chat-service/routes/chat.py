@@ -4,25 +4,81 @@ routes/chat.py — Streaming chat endpoint (SSE).
 from __future__ import annotations
 
 import asyncio
-import json
-from typing import Any, AsyncGenerator
+import logging
+import time
+from typing import Any, AsyncGenerator, AsyncIterator
 
+import orjson
 from fastapi import APIRouter
 from fastapi.responses import StreamingResponse
 from langchain_core.messages import AIMessage
 
+from config import chat_llm, vision_llm
 from models import ChatRequest
 from sessions import get_or_create_session
-from parsers import strip_think_tags, md_to_html, parse_canvas_json
-from tools import detect_tool_intent
-from prompts import chat_chain, canvas_chain, vision_chain
+from parsers import ThinkStreamFilter, md_to_html
+from tools import detect_tool_intent, mentions_drawing
+from prompts import build_chat_messages
+from canvas_gen import generate_canvas_elements
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
+# Max silence before a ": keepalive" comment, so proxies don't drop the
+# connection while the model is reasoning (<think> or reasoning-only chunks)
+KEEPALIVE_INTERVAL = 15  # seconds
 
-def _sse_event(data: dict) -> str:
-    """Format a dict as an SSE data line. Single allocation per event."""
-    return f"data: {json.dumps(data, separators=(',', ':'))}\n\n"
+# Tiny upstream chunks are coalesced into one token frame once this much
+# text is pending or this long has passed since the last write.
+TOKEN_BATCH_CHARS = 32
+TOKEN_BATCH_INTERVAL = 0.02  # seconds
+
+# How long a message waits for an earlier turn on the same session to finish
+LOCK_WAIT_TIMEOUT = 30  # seconds
+
+
+# Token frames dominate the stream, so their constant envelope is pre-encoded
+# and only the token string itself goes through orjson.
+_TOKEN_PREFIX = b'data: {"type":"token","done":false,"token":'
+_TOKEN_SUFFIX = b"}\n\n"
+
+
+def _sse_event(data: dict) -> bytes:
+    """Format a dict as an SSE data line (orjson output is already compact)."""
+    return b"data: " + orjson.dumps(data) + b"\n\n"
+
+
+def _sse_token(token: str) -> bytes:
+    """Format a streamed text token as an SSE data line."""
+    return _TOKEN_PREFIX + orjson.dumps(token) + _TOKEN_SUFFIX
+
+
+def _discard(task: asyncio.Task) -> None:
+    """Drop a speculative task: cancel it, or collect its error if it already failed.
+
+    Cancelling a canvas task also cancels its canvas_chain call when no
+    other request is waiting on it (see canvas_gen).
+    """
+    if not task.done():
+        task.cancel()
+    elif not task.cancelled():
+        task.exception()
+
+
+async def _next_chunk(stream: AsyncIterator[Any]) -> Any | None:
+    """Next item of an async stream, or None once it is exhausted."""
+    return await anext(stream, None)
+
+
+async def _keepalive_until(task: asyncio.Future) -> AsyncGenerator[bytes, None]:
+    """Yield an SSE keepalive comment every KEEPALIVE_INTERVAL until `task` is done.
+
+    The caller reads `task.result()` afterwards; the task is never cancelled here.
+    """
+    while not task.done():
+        await asyncio.wait((task,), timeout=KEEPALIVE_INTERVAL)
+        if not task.done():
+            yield b": keepalive\n\n"
 
 
 @router.post("/chat")
@@ -30,7 +86,7 @@ async def chat(req: ChatRequest):
     """Streaming chat endpoint using Server-Sent Events.
 
     Two-phase pipeline:
-      Phase 1: Stream text tokens from chat_chain.astream()
+      Phase 1: Stream text tokens from chat_llm.astream()
       Phase 2: Either route to AI tool OR generate canvas elements
 
     SSE event types:
@@ -43,69 +99,133 @@ async def chat(req: ChatRequest):
     session = get_or_create_session(req.session_id)
     session_id = session.session_id
 
-    # Build chain input
-    chain_input = session.get_chain_input(req.message, req.image_data)
-
     # Detect which AI tool (if any) should handle this message
     tool_intent = detect_tool_intent(req.message)
 
-    async def generate() -> AsyncGenerator[str, None]:
+    async def generate() -> AsyncGenerator[bytes, None]:
         """SSE generator — yields data lines for each event.
 
         Performance notes:
         - Uses local references to avoid global/attribute lookups in hot loop
         - Generator-based (constant memory regardless of response length)
-        - Pre-formats SSE events with compact JSON separators
+        - Token frames reuse a pre-encoded envelope; events are yielded as bytes
+        - Tiny chunks are batched (TOKEN_BATCH_CHARS / TOKEN_BATCH_INTERVAL)
+        - Timer-driven: batch flushes and keepalives go out while the upstream,
+          the session lock or the canvas call is silent
         """
-        _strip_think = strip_think_tags
         _sse = _sse_event
-
-        full_response_parts: list[str] = []
+        _sse_tok = _sse_token
+        _clock = time.monotonic
+
+        # Visible text is collected as it streams; <think> blocks never reach
+        # the client or the clean response, so no post-stream regex is needed.
+        think_filter = ThinkStreamFilter()
+        clean_parts: list[str] = []
+        pending: list[str] = []  # visible text not yet sent
+        pending_len = 0
         reasoning_details_accum: list[str] = []
-        inside_think = False
-        chunks_yielded = 0
+        chunk_count = 0
+        canvas_task: asyncio.Task[list[dict] | None] | None = None
+        lock_task: asyncio.Task[bool] | None = None
 
         try:
-            yield ": heartbeat\n\n"
-
-            print(f"[Chat] Starting LLM stream for session {session_id}")
+            # Flush headers immediately; the first token may be seconds away
+            yield b": heartbeat\n\n"
+
+            # One turn at a time per session: the user message, the reply and
+            # canvas updates land in history as a unit even if a second tab
+            # sends a message on the same session mid-stream. Held until the
+            # generator finishes (released in the finally below).
+            lock_task = asyncio.create_task(
+                asyncio.wait_for(session.lock.acquire(), LOCK_WAIT_TIMEOUT)
+            )
+            async for frame in _keepalive_until(lock_task):
+                yield frame
+            try:
+                lock_task.result()
+            except asyncio.TimeoutError:
+                logger.warning("Session %s busy, gave up waiting for the previous turn", session_id)
+                yield _sse({
+                    "type": "error",
+                    "token": "",
+                    "done": True,
+                    "error": "Still answering your previous message. Please try again in a moment.",
+                    "session_id": session_id,
+                })
+                return
+
+            last_write = _clock()
+            chain_input = session.get_chain_input(req.message, req.image_data)
+
+            # Canvas generation only needs the user message, so it runs
+            # alongside the text stream instead of after it.
+            if tool_intent and tool_intent["tool"] == "draw":
+                canvas_task = asyncio.create_task(
+                    generate_canvas_elements(req.message, chain_input["canvas_context"])
+                )
+
+            logger.info("Starting LLM stream for session %s", session_id)
 
             async with asyncio.timeout(90):
-                chain_to_use = vision_chain if req.image_data else chat_chain
-                async for chunk in chain_to_use.astream(chain_input):
-                    rd = chunk.additional_kwargs.get("reasoning_details") or getattr(chunk, "reasoning_details", None)
-                    if rd:
-                        reasoning_details_accum.append(str(rd))
-
-                    token = chunk.content if hasattr(chunk, "content") else str(chunk)
-                    if not token:
-                        continue
-
-                    full_response_parts.append(token)
-
-                    # Filter <think>...</think> blocks during streaming
-                    if "<think>" in token:
-                        inside_think = True
-                    if inside_think:
-                        if "</think>" in token:
-                            inside_think = False
-                            after = token.split("</think>", 1)[1]
-                            if after.strip():
-                                yield _sse({"type": "token", "token": after, "done": False})
-                                chunks_yielded += 1
-                        else:
-                            chunks_yielded += 1
-                            if chunks_yielded % 10 == 0:
-                                yield ": keepalive\n\n"
-                        continue
-
-                    yield _sse({"type": "token", "token": token, "done": False})
-
-            print(f"[Chat] LLM stream completed, {len(full_response_parts)} chunks")
-
-            # Assemble full response
-            full_response = "".join(full_response_parts)
-            clean_response = _strip_think(full_response)
+                llm = vision_llm if req.image_data else chat_llm
+                stream = llm.astream(build_chat_messages(chain_input))
+                next_chunk: asyncio.Task | None = None
+                try:
+                    while True:
+                        if next_chunk is None:
+                            next_chunk = asyncio.create_task(_next_chunk(stream))
+                        # Wake for the next chunk, a due batch flush or a keepalive,
+                        # so a silent upstream still gets pending text and pings out
+                        wait = (TOKEN_BATCH_INTERVAL if pending else KEEPALIVE_INTERVAL) - (_clock() - last_write)
+                        if wait > 0:
+                            await asyncio.wait((next_chunk,), timeout=wait)
+
+                        if next_chunk.done():
+                            chunk = next_chunk.result()
+                            next_chunk = None
+                            if chunk is None:
+                                break
+
+                            rd = chunk.additional_kwargs.get("reasoning_details")
+                            if rd:
+                                reasoning_details_accum.append(rd if isinstance(rd, str) else str(rd))
+
+                            # Chat models stream AIMessageChunk, which always has .content
+                            token = chunk.content
+                            if token:
+                                chunk_count += 1
+                                visible = think_filter.feed(token)
+                                if visible:
+                                    clean_parts.append(visible)
+                                    pending.append(visible)
+                                    pending_len += len(visible)
+
+                        now = _clock()
+                        if pending and (
+                            pending_len >= TOKEN_BATCH_CHARS
+                            or now - last_write >= TOKEN_BATCH_INTERVAL
+                        ):
+                            yield _sse_tok("".join(pending))
+                            pending.clear()
+                            pending_len = 0
+                            last_write = now
+                        elif now - last_write >= KEEPALIVE_INTERVAL:
+                            yield b": keepalive\n\n"
+                            last_write = now
+                finally:
+                    if next_chunk is not None:
+                        next_chunk.cancel()
+
+                tail = think_filter.flush()
+                if tail:
+                    clean_parts.append(tail)
+                    pending.append(tail)
+                if pending:
+                    yield _sse_tok("".join(pending))
+
+            logger.info("LLM stream completed, %d chunks", chunk_count)
+
+            clean_response = "".join(clean_parts).lstrip("\n")
 
             final_reasoning = "".join(reasoning_details_accum)
 
@@ -113,10 +233,10 @@ async def chat(req: ChatRequest):
             if final_reasoning:
                 ai_msg.additional_kwargs["reasoning_details"] = final_reasoning
 
-            session.messages.append(ai_msg)
-            session.trim_history()
+            session.add_message(ai_msg)
 
-            html = md_to_html(clean_response)
+            # CPU-bound render runs off the event loop so other streams keep flowing
+            html = await asyncio.to_thread(md_to_html, clean_response)
 
             yield _sse({
                 "type": "done",
@@ -129,16 +249,18 @@ async def chat(req: ChatRequest):
             # Phase 2: Route to AI tool or canvas_chain
             if tool_intent:
                 tool_name = tool_intent["tool"]
-                print(f"[Chat] Tool intent detected: {tool_name}")
+                logger.info("Tool intent detected: %s", tool_name)
 
                 if tool_name == "draw":
-                    canvas_input = {
-                        "canvas_context": session.canvas_context,
-                        "input": req.message,
-                    }
-                    async with asyncio.timeout(60):
-                        raw_output = await canvas_chain.ainvoke(canvas_input)
-                    elements = parse_canvas_json(raw_output)
+                    # The draw fallback matches broad verbs ("add", "make"),
+                    # so only apply the canvas result when the reply also
+                    # talks about drawing something.
+                    if not mentions_drawing(clean_response):
+                        logger.info("Draw intent not confirmed by reply, discarding canvas generation")
+                        return
+                    async for frame in _keepalive_until(canvas_task):
+                        yield frame
+                    elements = canvas_task.result()
 
                     if elements:
                         drawn_parts: list[str] = []
@@ -173,7 +295,7 @@ async def chat(req: ChatRequest):
                     yield _sse(tool_event)
 
         except asyncio.TimeoutError:
-            print(f"[Chat] LLM timeout for session {session_id}")
+            logger.warning("LLM timeout for session %s", session_id)
             yield _sse({
                 "type": "error",
                 "token": "",
@@ -182,14 +304,25 @@ async def chat(req: ChatRequest):
                 "session_id": session_id,
             })
         except Exception as e:
-            print(f"[Chat] Error for session {session_id}: {e}")
+            # Full details go to the log; the client only gets the error class,
+            # since provider exceptions can embed multi-KB response bodies.
+            logger.exception("Chat failed for session %s", session_id)
             yield _sse({
                 "type": "error",
                 "token": "",
                 "done": True,
-                "error": str(e),
+                "error": f"Chat request failed ({type(e).__name__}). Please try again.",
                 "session_id": session_id,
             })
+        finally:
+            # Stream errors, skipped draws and client disconnects all land here
+            if canvas_task is not None:
+                _discard(canvas_task)
+            if lock_task is not None:
+                if lock_task.done() and not lock_task.cancelled() and lock_task.exception() is None:
+                    session.lock.release()
+                else:
+                    lock_task.cancel()
 
     return StreamingResponse(
         generate(),
@@ -187,7 +187,7 @@ Respond with ONLY a JSON array where each item has:
 
 Example: [{{"label": "Project Overview", "speakerNotes": "This slide introduces the main project goals and timeline."}}]"""
 
-            response = llm.invoke(prompt)
+            response = await llm.ainvoke(prompt)
             content = response.content if hasattr(response, "content") else str(response)
 
             # Parse JSON from response
@@ -288,7 +288,7 @@ Respond with ONLY a JSON array where each item has:
 Be specific to the actual content shown on each slide."""
 
     try:
-        response = llm.invoke(prompt)
+        response = await llm.ainvoke(prompt)
         content = response.content if hasattr(response, "content") else str(response)
 
         json_start = content.find("[")
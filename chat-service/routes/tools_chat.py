@@ -16,6 +16,7 @@ from typing import Any, AsyncGenerator
 
 from langsmith import traceable
 import httpx
+import orjson
 from fastapi import APIRouter
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
@@ -28,9 +29,9 @@ from mcp_client import list_tools, call_tool, mcp_tools_to_openai_functions, MCP
 router = APIRouter()
 
 
-def _sse(data: dict) -> str:
-    """Format a dict as an SSE data line."""
-    return f"data: {json.dumps(data, separators=(',', ':'))}\n\n"
+def _sse(data: dict) -> bytes:
+    """Format a dict as an SSE data line (orjson output is already compact)."""
+    return b"data: " + orjson.dumps(data) + b"\n\n"
 
 GROQ_CHAT_URL = "https://api.groq.com/openai/v1/chat/completions"
 GROQ_RESPONSES_URL = "https://api.groq.com/openai/v1/responses"
@@ -241,10 +242,10 @@ async def _call_builtin_tools(client: httpx.AsyncClient, message: str, enabled:
 async def _discover_mcp_tools(
     client: httpx.AsyncClient,
     mcp_servers: list[McpServerConfig],
-) -> AsyncGenerator[str | tuple[list[dict], dict[str, tuple[str, dict | None]]], None]:
+) -> AsyncGenerator[bytes | tuple[list[dict], dict[str, tuple[str, dict | None]]], None]:
     """Step 1: Connect to each MCP server and discover available tools.
 
-    Yields SSE status strings, then finally yields a (tools, server_map) tuple.
+    Yields SSE status frames, then finally yields a (tools, server_map) tuple.
     """
     all_tools: list[dict] = []
     tool_server_map: dict[str, tuple[str, dict | None]] = {}
@@ -303,7 +304,7 @@ async def _execute_mcp_tool(
     client: httpx.AsyncClient,
     tc: dict,
     tool_server_map: dict[str, tuple[str, dict | None]],
-) -> AsyncGenerator[str | dict, None]:
+) -> AsyncGenerator[bytes | dict, None]:
     """Step 3: Execute a single tool call on its MCP server.
 
     Yields SSE status strings and a tool_result dict.
@@ -379,7 +380,7 @@ async def _call_mcp_direct(client: httpx.AsyncClient, message: str, mcp_servers:
     tool_server_map: dict[str, tuple[str, dict | None]] = {}
 
     async for item in _discover_mcp_tools(client, mcp_servers):
-        if isinstance(item, str):
+        if isinstance(item, bytes):
             yield item
         else:
             all_tools, tool_server_map = item
@@ -404,7 +405,7 @@ async def _call_mcp_direct(client: httpx.AsyncClient, message: str, mcp_servers:
     tool_results: list[dict] = []
     for tc in tool_calls:
         async for item in _execute_mcp_tool(client, tc, tool_server_map):
-            if isinstance(item, str):
+            if isinstance(item, bytes):
                 yield item
             elif isinstance(item, dict) and "role" in item:
                 tool_results.append(item)
@@ -428,8 +429,8 @@ async def tools_chat(req: ToolChatRequest):
     has_builtin = len(req.builtin_tools) > 0
     has_mcp = len(req.mcp_servers) > 0
 
-    async def generate() -> AsyncGenerator[str, None]:
-        yield ": heartbeat\n\n"
+    async def generate() -> AsyncGenerator[bytes, None]:
+        yield b": heartbeat\n\n"
 
         try:
             async with httpx.AsyncClient(timeout=120) as client:
@@ -460,7 +461,7 @@ async def tools_chat(req: ToolChatRequest):
 
                     for chunk in _stream_text(clean):
                         yield chunk
-                    yield _final_event(session, session_id, req.message, clean)
+                    yield await _final_event(session, session_id, req.message, clean)
 
                 elif has_mcp:
                     # ── Route 2: Direct MCP client (no Groq gateway timeout) ──
@@ -469,8 +470,8 @@ async def tools_chat(req: ToolChatRequest):
 
                     content = ""
                     async for event in _call_mcp_direct(client, req.message, req.mcp_servers):
-                        if isinstance(event, str):
-                            # SSE event strings from yields
+                        if isinstance(event, bytes):
+                            # SSE event frames from yields
                             yield event
                         elif isinstance(event, dict) and "__content__" in event:
                             # Final content from the generator
@@ -482,7 +483,7 @@ async def tools_chat(req: ToolChatRequest):
                     clean = strip_think_tags(content)
                     for chunk in _stream_text(clean):
                         yield chunk
-                    yield _final_event(session, session_id, req.message, clean)
+                    yield await _final_event(session, session_id, req.message, clean)
 
                 else:
                     # No tools — should not reach here, but handle gracefully
@@ -494,7 +495,7 @@ async def tools_chat(req: ToolChatRequest):
                     })
 
         except httpx.HTTPStatusError as e:
-            body = e.response.text[:400] if e.response else str(e)
+            body = e.response.text[:400] if e.response else str(e)[:400]
             print(f"[ToolChat] HTTP {e.response.status_code}: {body}")
             yield _sse({
                 "type": "error",
@@ -506,7 +507,8 @@ async def tools_chat(req: ToolChatRequest):
             print(f"[ToolChat] Error: {e}")
             yield _sse({
                 "type": "error",
-                "error": str(e),
+                # Bounded: provider errors can embed multi-KB response bodies
+                "error": str(e)[:512] or type(e).__name__,
                 "done": True,
                 "session_id": session_id,
             })
@@ -536,13 +538,13 @@ def _stream_text(text: str):
         })
 
 
-def _final_event(session, session_id: str, user_msg: str, clean: str) -> str:
+async def _final_event(session, session_id: str, user_msg: str, clean: str) -> bytes:
     """Build the final 'done' SSE event and save to session history."""
-    html = md_to_html(clean)
+    html = await asyncio.to_thread(md_to_html, clean)
     from langchain_core.messages import HumanMessage, AIMessage
-    session.messages.append(HumanMessage(content=user_msg))
-    session.messages.append(AIMessage(content=clean))
-    session.trim_history()
+    async with session.lock:  # don't land inside a /chat turn in progress
+        session.add_message(HumanMessage(content=user_msg))
+        session.add_message(AIMessage(content=clean))
 
     return _sse({
         "type": "done",
@@ -2,16 +2,81 @@
 sessions.py — In-memory session management.
 
 Each ChatSession holds conversation history and canvas context.
-Sessions are cleaned up periodically to prevent memory leaks.
+The store is an LRU ordered by last access: it is capped at MAX_SESSIONS
+and idle sessions are cleaned up to prevent memory leaks.
 """
 from __future__ import annotations
 
+import asyncio
+import logging
+import time
 import uuid
-from datetime import datetime
+from collections import OrderedDict, deque
 
-from langchain_core.messages import HumanMessage, AIMessage
+from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
 
-from config import MAX_HISTORY_MESSAGES, SESSION_TTL_HOURS
+from config import (
+    MAX_HISTORY_MESSAGES, MAX_PROMPT_TOKENS, MAX_SESSIONS, PAGED_AFTER_MESSAGES, SESSION_TTL_HOURS,
+)
+
+logger = logging.getLogger(__name__)
+
+# Messages kept in full (PAGED_AFTER_MESSAGES, never above the
+# MAX_HISTORY_MESSAGES cap); older turns are paged out to one-line handles
+VERBATIM_MESSAGES = max(0, min(PAGED_AFTER_MESSAGES, MAX_HISTORY_MESSAGES))
+# Paged-out user turns kept as one-line handles, and their max length
+PAGED_SUMMARY_LINES = 8
+PAGED_SNIPPET_CHARS = 80
+
+# Prompt budget in characters (~4 chars per token for English text). The
+# canvas context may use a quarter of it; history fills what the current
+# turn leaves, newest messages first.
+PROMPT_CHAR_BUDGET = MAX_PROMPT_TOKENS * 4
+CANVAS_CONTEXT_CHARS = PROMPT_CHAR_BUDGET // 4
+
+# /chat appends one of these blocks to the canvas context per drawing
+_DRAWN_MARKER = "\n\nAI just drew "
+_DRAWN_OMITTED = "\n\n...(earlier AI drawings omitted)"
+_TRUNCATED = "\n...(truncated)"
+
+
+def _text_len(message: HumanMessage | AIMessage) -> int:
+    """Length of a message's text (image parts are not counted)."""
+    content = message.content
+    if isinstance(content, str):
+        return len(content)
+    return sum(len(part.get("text", "")) for part in content if isinstance(part, dict))
+
+
+def _fit_canvas_context(context: str) -> str:
+    """Trim canvas context to CANVAS_CONTEXT_CHARS, keeping the newest notes.
+
+    The board description comes first and "AI just drew" notes are appended
+    after it. The newest notes are kept (up to what leaves the description
+    at least half the budget); older ones are dropped, and the description
+    is cut short if it still doesn't fit.
+    """
+    limit = CANVAS_CONTEXT_CHARS
+    if len(context) <= limit:
+        return context
+
+    base, *drawn = context.split(_DRAWN_MARKER)
+    note_room = limit - min(len(base), limit // 2) - len(_DRAWN_OMITTED)
+    kept: list[str] = []
+    for block in reversed(drawn):
+        note = _DRAWN_MARKER + block
+        if len(note) > note_room:
+            break
+        note_room -= len(note)
+        kept.append(note)
+    notes = "".join(reversed(kept))
+    if len(kept) < len(drawn):
+        notes = _DRAWN_OMITTED + notes
+
+    base_room = max(0, limit - len(notes))
+    if len(base) > base_room:
+        base = base[:base_room - len(_TRUNCATED)] + _TRUNCATED if base_room > len(_TRUNCATED) else ""
+    return (base + notes)[:limit]
 
 
 class ChatSession:
@@ -20,48 +85,116 @@ class ChatSession:
     Uses __slots__ for 40-60% memory savings per instance (Pattern 13).
     Typical deployment with 1000 concurrent sessions saves ~200KB.
     """
-    __slots__ = ("session_id", "messages", "canvas_context", "created_at", "last_active")
+    __slots__ = ("session_id", "messages", "summary", "_summary_msg", "canvas_context", "created_at", "last_active", "lock")
 
     def __init__(self, session_id: str) -> None:
         self.session_id = session_id
-        self.messages: list[HumanMessage | AIMessage] = []
+        # Recent turns in full; add_message pages out whole turns once there
+        # are more than VERBATIM_MESSAGES, with O(1) pops from the left.
+        self.messages: deque[HumanMessage | AIMessage] = deque()
+        # One-line handles for user turns that fell out of `messages`
+        self.summary: deque[str] = deque(maxlen=PAGED_SUMMARY_LINES)
+        self._summary_msg: SystemMessage | None = None  # rendered `summary`, rebuilt on change
         self.canvas_context: str = "The whiteboard is currently completely empty."
-        self.created_at: datetime = datetime.now()
-        self.last_active: datetime = datetime.now()
+        # time.monotonic() seconds: TTL checks are a float subtraction
+        self.created_at: float = time.monotonic()
+        self.last_active: float = self.created_at
+        # Serializes chat turns so concurrent requests can't interleave history
+        self.lock = asyncio.Lock()
+
+    def add_message(self, message: HumanMessage | AIMessage) -> None:
+        """Append to history, paging turns past VERBATIM_MESSAGES out.
+
+        Old turns are replaced by a short handle instead of being carried in
+        full, so the model keeps the thread of the conversation without
+        re-sending every earlier message.
+        """
+        self.messages.append(message)
+        while len(self.messages) > VERBATIM_MESSAGES:
+            self._page_out_oldest_turn()
 
-    def trim_history(self) -> None:
-        """Cap conversation history to prevent unbounded memory growth.
+    def _page_out_oldest_turn(self) -> None:
+        """Page out the oldest user message together with its replies.
 
-        Uses list slicing (O(k) where k = MAX_HISTORY_MESSAGES) instead of
-        repeated pop(0) which is O(n) per removal.
+        Removing whole turns keeps the verbatim history starting on a user
+        message rather than an orphaned assistant reply.
         """
-        if len(self.messages) > MAX_HISTORY_MESSAGES:
-            self.messages = self.messages[-MAX_HISTORY_MESSAGES:]
+        self._page_out(self.messages.popleft())
+        while self.messages and not isinstance(self.messages[0], HumanMessage):
+            self.messages.popleft()
+
+    def _page_out(self, message: HumanMessage | AIMessage) -> None:
+        """Record a dropped user turn as a one-line summary handle."""
+        if not isinstance(message, HumanMessage):
+            return
+        text = message.content
+        if isinstance(text, list):
+            text = " ".join(p.get("text", "") for p in text if p.get("type") == "text")
+        text = " ".join(text.split())
+        if len(text) > PAGED_SNIPPET_CHARS:
+            text = text[:PAGED_SNIPPET_CHARS - 1] + "…"
+        self.summary.append(f'- "{text}"')
+        self._summary_msg = None
+
+    def clear_history(self) -> None:
+        """Forget all conversation turns, including paged-out ones."""
+        self.messages.clear()
+        self.summary.clear()
+        self._summary_msg = None
+
+    def _get_summary_message(self) -> SystemMessage:
+        """Paged-out summary as a SystemMessage, rendered only when it changed."""
+        if self._summary_msg is None:
+            self._summary_msg = SystemMessage(content=(
+                "[Paged out: earlier requests from this conversation]\n"
+                + "\n".join(self.summary)
+            ))
+        return self._summary_msg
 
     def get_chain_input(self, user_input: str, image_data: str | None = None) -> dict:
-        """Build the input dict for LCEL chains."""
-        self.last_active = datetime.now()
+        """Build the input dict for the chat messages and chains."""
+        self.last_active = time.monotonic()
         
         if image_data:
             content = [
                 {"type": "text", "text": user_input},
                 {"type": "image_url", "image_url": {"url": image_data}}
             ]
-            self.messages.append(HumanMessage(content=content))
+            self.add_message(HumanMessage(content=content))
         else:
-            self.messages.append(HumanMessage(content=user_input))
+            self.add_message(HumanMessage(content=user_input))
 
-        # Keep history bounded, excluding the message we JUST added
-        history = self.messages[-(MAX_HISTORY_MESSAGES):-1]
+        canvas_context = _fit_canvas_context(self.canvas_context)
 
         # Inject the live canvas context into the current turn
         injected_input = (
             f"[SYSTEM NOTE: Current Live Canvas Context]\n"
-            f"{self.canvas_context}\n\n"
+            f"{canvas_context}\n\n"
             f"[User Request]\n"
             f"{user_input}"
         )
 
+        # History is everything before the message we JUST added. Turns that
+        # don't fit next to the current one are paged out from the oldest end,
+        # so the summary still covers them.
+        history = list(self.messages)
+        if history:  # empty when VERBATIM_MESSAGES is 0
+            history.pop()
+        budget = PROMPT_CHAR_BUDGET - len(injected_input)
+        keep = 0
+        for message in reversed(history):
+            budget -= _text_len(message)
+            if budget < 0:
+                break
+            keep += 1
+        if keep < len(history):
+            while len(self.messages) - 1 > keep:
+                self._page_out_oldest_turn()
+            history = list(self.messages)
+            history.pop()
+        if self.summary:
+            history.insert(0, self._get_summary_message())
+
         if image_data:
             final_input = [
                 {"type": "text", "text": injected_input},
@@ -73,26 +206,62 @@ class ChatSession:
         return {
             "input": final_input,
             "history": history,
-            "canvas_context": self.canvas_context,
+            "canvas_context": canvas_context,
         }
 
 
 # ─── Session Storage ──────────────────────────────────────────────────────────
 
-_sessions: dict[str, ChatSession] = {}
+# Least recently used first, so eviction and stale cleanup pop from the front.
+_sessions: OrderedDict[str, ChatSession] = OrderedDict()
+
+
+def _touch(session: ChatSession) -> ChatSession:
+    """Mark a session as most recently used."""
+    session.last_active = time.monotonic()
+    _sessions.move_to_end(session.session_id)
+    return session
+
+
+def _evict_stale() -> int:
+    """Pop sessions idle for longer than SESSION_TTL_HOURS.
+
+    The store is ordered by last access, so only the expired prefix is
+    visited instead of every session.
+    """
+    cutoff = time.monotonic() - SESSION_TTL_HOURS * 3600
+    removed = 0
+    while _sessions:
+        oldest = next(iter(_sessions.values()))
+        if oldest.last_active >= cutoff:
+            break
+        _sessions.popitem(last=False)
+        removed += 1
+    return removed
 
 
 def get_or_create_session(session_id: str | None) -> ChatSession:
-    """Get existing session or create a new one."""
+    """Get existing session or create a new one.
+
+    Creating a session first drops idle sessions past SESSION_TTL_HOURS,
+    then evicts the least recently used beyond MAX_SESSIONS.
+    """
     sid = session_id or str(uuid.uuid4())
-    if sid not in _sessions:
-        _sessions[sid] = ChatSession(sid)
-    return _sessions[sid]
+    session = _sessions.get(sid)
+    if session is not None:
+        return _touch(session)
+
+    _evict_stale()
+    session = _sessions[sid] = ChatSession(sid)
+    while len(_sessions) > MAX_SESSIONS:
+        _sessions.popitem(last=False)
+    return session
 
 
 def get_session(session_id: str) -> ChatSession | None:
     """Get existing session or None."""
-    return _sessions.get(session_id)
+    session = _sessions.get(session_id)
+    return _touch(session) if session is not None else None
 
 
 def delete_session(session_id: str) -> bool:
@@ -101,17 +270,8 @@ def delete_session(session_id: str) -> bool:
 
 
 def cleanup_stale_sessions() -> int:
-    """Remove sessions older than SESSION_TTL_HOURS.
-
-    Called periodically to prevent memory leaks from abandoned sessions.
-    """
-    cutoff = datetime.now()
-    stale = [
-        sid for sid, s in _sessions.items()
-        if (cutoff - s.last_active).total_seconds() > SESSION_TTL_HOURS * 3600
-    ]
-    for sid in stale:
-        del _sessions[sid]
-    if stale:
-        print(f"[Cleanup] Removed {len(stale)} stale sessions")
-    return len(stale)
+    """Remove sessions idle for longer than SESSION_TTL_HOURS."""
+    removed = _evict_stale()
+    if removed:
+        logger.info("Removed %d stale sessions", removed)
+    return removed
@@ -12,8 +12,12 @@ Routes user messages to the appropriate AI tool:
 """
 from __future__ import annotations
 
+import re
+from functools import lru_cache
 from typing import Any
 
+import ahocorasick
+
 
 # ─── Keyword Maps ─────────────────────────────────────────────────────────────
 
@@ -59,6 +63,47 @@ _DRAW_KEYWORDS: frozenset[str] = frozenset({
     "organize", "arrange", "connect", "link",
 })
 
+# One compiled alternation replaces ~25 separate substring scans. Longest
+# keywords first so the alternation prefers the most specific phrase; the
+# word boundaries stop "link" matching inside "blinking" and similar.
+_DRAW_INTENT_RE: re.Pattern[str] = re.compile(
+    r"(?<!\w)(?:"
+    + "|".join(re.escape(kw) for kw in sorted(_DRAW_KEYWORDS, key=len, reverse=True))
+    + r")(?:s|es|ing)?(?!\w)",
+    re.IGNORECASE,
+)
+
+# Reply-side gate for the draw fallback: does the assistant's reply say it
+# is drawing something? Replies use past/progressive and irregular forms
+# ("I've drawn", "Sketching", "I created") and name what they draw, so this
+# is its own vocabulary of stems and nouns rather than the user-intent list.
+_DRAW_CONFIRM_RE: re.Pattern[str] = re.compile(
+    r"(?<!\w)(?:"
+    r"draw(?:s|n|ing)?|drew"
+    r"|add(?:s|ed|ing)?"
+    r"|creat(?:e|es|ed|ing)"
+    r"|plac(?:e|es|ed|ing)"
+    r"|mak(?:e|es|ing)|made"
+    r"|buil(?:d|ds|t|ding)"
+    r"|put(?:s|ting)?"
+    r"|insert(?:s|ed|ing)?"
+    r"|sketch(?:es|ed|ing)?"
+    r"|generat(?:e|es|ed|ing)"
+    r"|design(?:s|ed|ing)?"
+    r"|arrang(?:e|es|ed|ing)"
+    r"|connect(?:s|ed|ing)?"
+    r"|flow ?charts?|diagrams?|mind ?maps?|charts?|wireframes?|layouts?"
+    r"|box(?:es)?|circles?|rectangles?|arrows?|shapes?|ellipses?|diamonds?"
+    r"|sticky notes?"
+    r")(?!\w)",
+    re.IGNORECASE,
+)
+
+# No keyword fits in a shorter message, so those skip lower() and all scans
+_MIN_KEYWORD_LEN: int = min(
+    len(kw) for kws in (*_TOOL_KEYWORDS.values(), _DRAW_KEYWORDS) for kw in kws
+)
+
 _DIAGRAM_STYLES: list[tuple[str, str]] = [
     ("class diagram", "class"),
     ("er diagram", "erDiagram"),
@@ -89,6 +134,44 @@ _DIAGRAM_STYLES: list[tuple[str, str]] = [
 ]
 
 
+# ─── Keyword Automaton ────────────────────────────────────────────────────────
+#
+# One Aho-Corasick automaton built at import: a single linear pass over the
+# message reports every tool keyword and diagram-style keyword (overlaps
+# included), replacing one substring scan per keyword. Same substring
+# semantics as `kw in msg`.
+
+def _build_keyword_automaton() -> ahocorasick.Automaton:
+    """Map each keyword to (tool hit, style rank), either of which may be None.
+
+    Tool hits are (priority, tool) with lower priority winning, in
+    _TOOL_KEYWORDS order; style ranks index _DIAGRAM_STYLES, earlier entries
+    winning. A phrase like "class diagram" is both.
+    """
+    hits: dict[str, tuple[tuple[int, str] | None, int | None]] = {}
+    for prio, (tool, kws) in enumerate(_TOOL_KEYWORDS.items()):
+        for kw in kws:
+            hits.setdefault(kw, ((prio, tool), None))
+    for rank, (kw, _style) in enumerate(_DIAGRAM_STYLES):
+        tool_hit, style_rank = hits.get(kw, (None, None))
+        if style_rank is None:
+            hits[kw] = (tool_hit, rank)
+
+    automaton = ahocorasick.Automaton()
+    for kw, value in hits.items():
+        automaton.add_word(kw, value)
+    automaton.make_automaton()
+    return automaton
+
+
+_KEYWORD_AUTOMATON = _build_keyword_automaton()
+
+
+def mentions_drawing(text: str) -> bool:
+    """True if a reply confirms a drawing (case-insensitive, whole word)."""
+    return _DRAW_CONFIRM_RE.search(text) is not None
+
+
 def detect_tool_intent(message: str) -> dict | None:
     """Detect which AI tool the user's message needs.
 
@@ -104,26 +187,48 @@ def detect_tool_intent(message: str) -> dict | None:
         {"tool": "draw"}    — fallback to canvas_chain
         None                — plain chat
     """
-    msg_lower = message.lower()
+    intent = _classify(message)
+    if intent is None:
+        return None
+
+    tool_name, style = intent
+    result: dict[str, Any] = {"tool": tool_name, "prompt": message}
+    if style is not None:
+        result["style"] = style
+    return result
 
-    # Check specific tools first (highest priority)
-    for tool_name, keywords in _TOOL_KEYWORDS.items():
-        if any(kw in msg_lower for kw in keywords):
-            result: dict[str, Any] = {"tool": tool_name, "prompt": message}
 
-            # For diagrams, detect the style
-            if tool_name == "diagram":
-                style = "flowchart"
-                for keyword, diagram_style in _DIAGRAM_STYLES:
-                    if keyword in msg_lower:
-                        style = diagram_style
-                        break
-                result["style"] = style
+@lru_cache(maxsize=512)
+def _classify(message: str) -> tuple[str, str | None] | None:
+    """Resolve a message to (tool, diagram style or None), or None for plain chat.
+
+    Memoized: repeated messages (retries, button-triggered prompts) skip
+    the scans. Returns an immutable tuple so cached values can't be mutated
+    by callers; detect_tool_intent builds a fresh dict from it.
+    """
+    if len(message) < _MIN_KEYWORD_LEN:
+        return None
+
+    msg_lower = message.lower()
 
-            return result
+    # One scan finds the best tool (highest priority) and diagram style
+    best: tuple[int, str] | None = None
+    style_rank: int | None = None
+    for _end, (tool_hit, rank) in _KEYWORD_AUTOMATON.iter(msg_lower):
+        if tool_hit is not None and (best is None or tool_hit < best):
+            best = tool_hit
+        if rank is not None and (style_rank is None or rank < style_rank):
+            style_rank = rank
+
+    if best is not None:
+        tool_name = best[1]
+        # For diagrams, attach the detected style
+        if tool_name == "diagram":
+            return tool_name, "flowchart" if style_rank is None else _DIAGRAM_STYLES[style_rank][1]
+        return tool_name, None
 
     # Fallback: basic shape drawing
-    if any(kw in msg_lower for kw in _DRAW_KEYWORDS):
-        return {"tool": "draw", "prompt": message}
+    if _DRAW_INTENT_RE.search(message) is not None:
+        return "draw", None
 
     return None